@@ -45,21 +45,55 @@ GAMEPLAY INSTRUCTIONS:
 -be patient for the algorithim to process in the
  early moves if the depth is set to a 'high' amount.
 
+SEARCH TRACING:
+
+-set bTrace to True to stream the explored alpha-beta tree of every
+ computer move to traceFileName as JSON lines.
+
+-traceDepthCap and traceSampleRate bound how much of the tree gets
+ recorded so the tracing does not slow the search down too much.
+
+-run "python SearchTraceSummary.py searchTrace.jsonl" afterwards to
+ see the hot subtrees and a flame-graph style view of each move.
+
+ENDGAME SOLVING:
+
+-once endgameEmptyCells or fewer cells are empty the algorithim solves the
+ position exactly (see ConnectFourEndgame.py) instead of searching on to
+ 'depth' and scoring it, which is both quicker and exact. Solved positions
+ are kept for the rest of the game.
+
+-running "python ConnectFourEndgame.py --records gameRecords.txt" writes
+ endgameFileName, a database of positions that are already solved, including
+ positions with more empty cells than the algorithim solves on the spot.
+ Every finished game is added to gameRecordFileName so the database can be
+ built from the games that actually get played. If the file is there it is
+ checked before searching anything.
+
+-wins are scored by how soon they happen (endgameWinScore less the ply the
+ game ends on), both in the search and in the database. So the algorithim
+ takes the quickest win it can see and, when it can see it is destined to
+ lose, plays the move that loses the slowest instead of ending the game early.
+
 Finn Thistle | May 2022
 """
 import sys
 import pygame
 import copy
+import json
 import math
-from time import time
+import random
+from time import time, perf_counter
+import ConnectFourGeometry as geometry
+import ConnectFourEndgame as endgame
 
 # CONSTANT VARIABLES:
 
     #Board Constants:
 width = 900
 height = 900
-rows = 6
-columns = 7
+rows = geometry.rows
+columns = geometry.columns
 squareSize = width/columns
 lineWidth = 10
 bgColor = "gray"
@@ -67,18 +101,33 @@ lineColor = "blue"
 margin = 0
 chipRadius = 60
 chipWidth = 60
-redChip = 1 #human
-yellowChip = 2 #computer
+redChip = geometry.redChip #human
+yellowChip = geometry.yellowChip #computer
 
     #Other Constants:
 infinity = math.inf
 screen = pygame.display.set_mode((width, height))
 bDebug = True
 
+    #Tracing Constants:
+bTrace = False #records the search tree of every computer move when True
+traceFileName = "searchTrace.jsonl"
+traceDepthCap = 4 #deepest move path (in plies from the root) that gets recorded
+traceSampleRate = 1.0 #chance that a child subtree within the depth cap gets recorded
+
+    #Endgame Constants:
+endgameEmptyCells = 12 #positions with this many empty cells or fewer get solved exactly
+endgameFileName = "endgame.c4eg" #written by ConnectFourEndgame.py, the game runs without it too
+gameRecordFileName = "gameRecords.txt" #the columns of every finished game, one game per line
+endgameWinScore = 1000000 #score of a win, less the ply the game ends on so quicker wins score higher
+
 class Board():
     def __init__(self):
         self.board = [[0 for c in range(columns)] for r in range(rows)]
         self.totalBoardChips = 0
+        self.winner = 0 #kept up to date by dropChip so checkBoard does not need to search the board
+        self.key = geometry.emptyKey #position key and the key of the mirror image, see ConnectFourGeometry.py
+        self.mirrorKey = geometry.emptyKey
     def __str__(self):
         """Prints the board into terminal."""
         returnString = ""
@@ -92,8 +141,17 @@ class Board():
             if not self.board[i][column]: #if it is empty
                 self.board[i][column] = playerChip #drops the chip to the 'bottom most' part of the board
                 self.totalBoardChips+=1
+                chipHeight = rows-1 - i #chips below this one in the column
+                self.key += geometry.keySteps[playerChip][column][chipHeight]
+                self.mirrorKey += geometry.keySteps[playerChip][columns-1 - column][chipHeight]
+                if not self.winner:
+                    self.winner = self.winnerThroughCell(i, column)
                 return i, column
 
+    def canonicalKey(self):
+        """Returns the key this board shares with its mirror image, for caches and databases."""
+        return min(self.key, self.mirrorKey)
+
     def bBoardFull(self):
         """Returns True if every slot has a chip"""
         return self.totalBoardChips==42
@@ -115,52 +173,17 @@ class Board():
             will return 1 if player 1 wins
             will return 2 if player 2 wins
         """
-        #VERTICLE WINS
-        for col in range(columns):
-            if (self.board[0][col]==self.board[1][col]==self.board[2][col]==self.board[3][col] != 0 or
-            self.board[1][col]==self.board[2][col]==self.board[3][col]==self.board[4][col] != 0 or
-            self.board[2][col]==self.board[3][col]==self.board[4][col]==self.board[5][col] != 0):
-                return self.board[2][col] #Return who occupies that space
-        #HORIZONTAL WINS
-        for row in range(rows):
-            if (self.board[row][0]==self.board[row][1]==self.board[row][2]==self.board[row][3]!=0 or
-            self.board[row][1]==self.board[row][2]==self.board[row][3]==self.board[row][4]!=0 or
-            self.board[row][2]==self.board[row][3]==self.board[row][4]==self.board[row][5]!=0 or
-            self.board[row][3]==self.board[row][4]==self.board[row][5]==self.board[row][6]!=0
-            ):
-                return self.board[row][3]
-        #DIAGNOL WINS
-        #NOTE: referenced from https://github.com/KeithGalli/Connect4-Python
-        for col in range(columns-3): 
-            for row in range(rows-3):#Checks Diagnols increasing
-                if self.board[row][col]==self.board[row+1][col+1]==self.board[row+2][col+2]==self.board[row+3][col+3] != 0:
-                    return self.board[row][col]
-            for r in range(3, rows):#Checks Diagnols decreasing
-                if self.board[r][col]==self.board[r-1][col+1]==self.board[r-2][col+2]==self.board[r-3][col+3] != 0:
-                    return self.board[r][col]
-            
-        return 0 #Return 0 if no wins yet
-    
-    def scoreWindow(self,player, window):#NOTE: referenced from https://github.com/KeithGalli/Connect4-Python
-        """
-        Scores current window based on how many yellow and
-        red chips are counted.
-        """
-        score = 0
-        opponent = redChip
-        if player == redChip: 
-            opponent = yellowChip
-        if window.count(player) == 4:
-            score += 100
-        elif window.count(player) == 3:          
-            score += 4
-        elif window.count(player) == 2:
-            score += 2
-
-        if window.count(opponent) == 3:  
-            score -= 6
+        return self.winner
+
+    def winnerThroughCell(self, row, column):
+        """Returns the player with a 4-in-a-row through the given cell, or 0 if there is none."""
+        board = self.board
+        for (r0, c0), (r1, c1), (r2, c2), (r3, c3) in geometry.cellWindows[row][column]:
+            winner = geometry.windowWinners[board[r0][c0] + 3*board[r1][c1] + 9*board[r2][c2] + 27*board[r3][c3]]
+            if winner:
+                return winner
+        return 0
 
-        return score
     def scoreOfBoardPosition(self, player):#NOTE: referenced from https://github.com/KeithGalli/Connect4-Python
         """
         Returns a score for the current board as a whole and position
@@ -172,33 +195,15 @@ class Board():
         # the more chips in the middle column contains the most possible different
         # connections
         
-        centerList = [i for i in self.board[3]] # list of chips in center column
-        centerCount = centerList.count(player)
+        centerCount = self.board[3].count(player) # chips in center column
         score += centerCount * 7  #og was 3
 
-        # horizontal
-        for row in range(rows):
-            rowList = [i for i in self.board[row]]
-            for col in range(columns-3):
-                window = rowList[col:col+4]
-                score += self.scoreWindow(player,window)
-
-        # vertical
-        for col in range(columns):
-            colList = [i for i in self.board[:col]]
-            for row in range(rows-3):
-                window = colList[row:row+4]
-                score += self.scoreWindow(player,window)
-
-        # diagonal
-        for row in range(rows-3):
-            for col in range(columns-3):
-                window = [self.board[row+i][col+i] for i in range(4)]
-                score += self.scoreWindow(player,window)
-        for row in range(rows-3):
-            for col in range(columns-3):
-                window = [self.board[row+3-i][col+i] for i in range(4)]
-                score += self.scoreWindow(player,window)
+        # every horizontal, vertical and diagonal window, scored through the
+        # precomputed pattern table in ConnectFourGeometry.py
+        board = self.board
+        windowScores = geometry.windowScores[player]
+        for (r0, c0), (r1, c1), (r2, c2), (r3, c3) in geometry.windows:
+            score += windowScores[board[r0][c0] + 3*board[r1][c1] + 9*board[r2][c2] + 27*board[r3][c3]]
 
         return score
 
@@ -214,9 +219,63 @@ class Board():
                 openColumns.append(i)
 
         return openColumns
+class SearchTracer():
+    """
+    Streams the nodes explored by miniMax_AlphaBeta to a JSON lines file.
+
+    Every computer move writes one search record followed by one record per
+    traced node. Nodes are written when they return, so children come before
+    their parent.
+    """
+    def __init__(self, fileName, depthCap, sampleRate):
+        self.traceFile = open(fileName, "w")
+        self.depthCap = depthCap
+        self.sampleRate = sampleRate
+        self.searchCount = 0
+
+    def beginSearch(self, board, depth):
+        """Writes the header record for a new bestMove call."""
+        self.searchCount += 1
+        self.write({"search": self.searchCount, "depth": depth, "chips": board.totalBoardChips})
+
+    def endSearch(self):
+        """Makes sure the search is on disk before the game carries on."""
+        self.traceFile.flush()
+
+    def bTraceChild(self, path):
+        """Returns True if the child subtree below path should be recorded."""
+        if len(path) >= self.depthCap:
+            return False
+        return self.sampleRate >= 1 or random.random() < self.sampleRate
+
+    def recordNode(self, path, alpha, beta, score, bCutoff, seconds):
+        """Writes a single explored node."""
+        self.write({"search": self.searchCount, "path": list(path), "alpha": self.traceScore(alpha),
+                    "beta": self.traceScore(beta), "score": self.traceScore(score), "cutoff": bCutoff, "time": seconds})
+
+    def traceScore(self, score):
+        """JSON has no infinity, so infinite scores are written as the strings "inf" and "-inf"."""
+        if score == infinity:
+            return "inf"
+        if score == -infinity:
+            return "-inf"
+        return score
+
+    def write(self, record):
+        self.traceFile.write(json.dumps(record, allow_nan=False) + "\n")
 class BestmoveAlgorithm():
     def __init__(self):
         self.player = 2
+        self.tracer = None
+        if bTrace:
+            self.tracer = SearchTracer(traceFileName, traceDepthCap, traceSampleRate)
+        try:
+            self.endgame = endgame.loadTable(endgameFileName)
+        except ValueError as error: #an old or broken file, the game still works without it
+            if bDebug: print("WARNING: not using the endgame database:", error)
+            self.endgame = None
+        self.endgameSolved = {} #exact results worked out so far this game, by canonical key
+        if bDebug and self.endgame: print(f"Loaded {len(self.endgame)} endgame positions")
 
     def minimax(self, board, depth, maximizingPlayer):
         """An implementation of the min max algorithim with alpa-beta pruning. 
@@ -264,62 +323,145 @@ class BestmoveAlgorithm():
                     bestMoveYet = col
             return bestMoveYet, worstScoreYet
 
-    def miniMax_AlphaBeta(self, board, depth, alpha, beta, maximizingPlayer):#NOTE: referenced from https://github.com/KeithGalli/Connect4-Python
+    def miniMax_AlphaBeta(self, board, depth, alpha, beta, maximizingPlayer, path=None):#NOTE: referenced from https://github.com/KeithGalli/Connect4-Python
         """An implementation of the min max algorithim with alpa-beta pruning. 
-        Using all dynamic variables in its recursive calls."""
+        Using all dynamic variables in its recursive calls.
         
-        openColumnList = board.allOpenColumns()
-
-        if not openColumnList:return (None, board.scoreOfBoardPosition(yellowChip)) #This is my attempt to fix the problem in my note in the allOpenColumns method above
+        path is the tuple of columns played from the root and is only
+        given while the node is being traced, otherwise it stays None."""
+        if path is not None:
+            return self.tracedAlphaBeta(board, depth, alpha, beta, maximizingPlayer, path)
 
+        openColumnList = board.allOpenColumns()
+        leafScore = self.leafScore(board, depth, openColumnList)
+        if leafScore is not None:
+            return (None, leafScore)
+
+        # NOTE: this loop and the one in tracedAlphaBeta must stay in step, or the trace
+        # describes a different tree from the one searched. Change updateAlphaBeta instead.
+        playerChip = yellowChip if maximizingPlayer else redChip
+        bestScoreYet = -infinity if maximizingPlayer else infinity
+        bestMoveYet = openColumnList[0] #Initializing it to the first column in the array, which will be changed if a better column is found
+        for col in openColumnList:
+            tempBoard = copy.deepcopy(board) #create a copy of the current board parameter passed in
+            tempBoard.dropChip(col, playerChip) #simulate dropping a chip here
+            tempScore = self.miniMax_AlphaBeta(tempBoard, depth-1, alpha, beta, not maximizingPlayer)[1] #subtracts the recursive depth variable so we can keep track of how many itterations we are going through
+            bestScoreYet, bestMoveYet, alpha, beta = self.updateAlphaBeta(maximizingPlayer, col, tempScore, bestScoreYet, bestMoveYet, alpha, beta)
+            if alpha >= beta: # 'Prune' the tree (Breakout of the loop), as the best response to each of these  options have already been found
+                break
+        return bestMoveYet, bestScoreYet
+
+    def updateAlphaBeta(self, maximizingPlayer, col, tempScore, bestScoreYet, bestMoveYet, alpha, beta):
+        """Takes in the score of the child reached by col and returns the new
+        bestScoreYet, bestMoveYet, alpha and beta. Shared by miniMax_AlphaBeta and
+        tracedAlphaBeta so both always search the same tree."""
+        if maximizingPlayer: # Maximizing player(COMPUTER)
+            if tempScore > bestScoreYet: #if a better option is found reset the score and the column
+                bestScoreYet = tempScore
+                bestMoveYet = col
+            if bestScoreYet > alpha:   #keep track of alpha value for later iterations of minimax function, and reset it if aplicable
+                alpha = bestScoreYet
+        else: # Minimizing player(HUMAN)
+            if tempScore < bestScoreYet:
+                bestScoreYet = tempScore
+                bestMoveYet = col
+            if bestScoreYet < beta:
+                beta = bestScoreYet
+        return bestScoreYet, bestMoveYet, alpha, beta
+
+    def leafScore(self, board, depth, openColumnList):
+        """Returns the score of board if the search stops here, or None if it has to look deeper."""
+        # A win is scored by the ply it happens on, on the same scale as the endgame
+        # database, so quicker wins and slower losses score better. With a flat
+        # +/-infinity every losing move tied and the first column got played.
         case = board.checkBoard()
-        if depth == 0 or case:
-            if case:
-                if case == 2:
-                    return (None, infinity)
-                elif case == 1:
-                    return (None, -infinity)
-                else: # board is full at this point
-                    return (None, 0)
-            else: #depth is 0
-                return (None, board.scoreOfBoardPosition(yellowChip))
-                # if maximizingPlayer:
-                #     return (None, board.scoreOfBoardPosition(yellowChip)) # Score the current board iteration
-                # else:
-                #     return (None, board.scoreOfBoardPosition(redChip))
-        if maximizingPlayer: # Minimizing player(COMPUTER)
-            bestScoreYet = -infinity
-            bestMoveYet = openColumnList[0] #Initializing it to the first column in the array, which will be changed if a better column is found
-            for col in openColumnList:
-                tempBoard = copy.deepcopy(board) #create a copy of the current board parameter passed in
-                tempBoard.dropChip(col, yellowChip) #simulate dropping a chip here
-                tempScore = self.miniMax_AlphaBeta(tempBoard, depth-1, alpha, beta, False)[1] #subtracts the recursive depth variable so we can keep track of how many itterations we are going through
-                if tempScore > bestScoreYet: #if a better option is found reset the score and the column
-                    bestScoreYet = tempScore
-                    bestMoveYet = col
-                if bestScoreYet > alpha:   #keep track of alpha value for later iterations of minimax function, and reset it if aplicable
-                    alpha = bestScoreYet
-                if alpha >= beta: # 'Prune' the tree (Breakout of the loop), as the best response to each of these  options have already been found
-                    break
-            return bestMoveYet, bestScoreYet
+        if case == yellowChip:
+            return endgameWinScore - board.totalBoardChips
+        elif case == redChip:
+            return -(endgameWinScore - board.totalBoardChips)
+        if not openColumnList: # board is full at this point, so the game is a draw
+            return 0
+
+        endgameScore = self.endgameScore(board)
+        if endgameScore is not None: #exact result is already known
+            return endgameScore
+        if depth == 0:
+            return board.scoreOfBoardPosition(yellowChip)
+        return None
+
+    def tracedAlphaBeta(self, board, depth, alpha, beta, maximizingPlayer, path):
+        """
+        The same search as miniMax_AlphaBeta for a node that is being traced. It
+        times the node, notes whether it was pruned and picks which children get
+        traced, so the untraced search does not pay for any of that.
+        """
+        start = perf_counter()
+        entryAlpha, entryBeta = alpha, beta
+        bCutoff = False
+        bestMoveYet = None
 
-        else: # Minimizing player(HUMAN)
-            worstScoreYet = infinity
+        openColumnList = board.allOpenColumns()
+        bestScoreYet = self.leafScore(board, depth, openColumnList)
+        if bestScoreYet is None:
+            # NOTE: must stay in step with the loop in miniMax_AlphaBeta, only the child
+            # path and the cutoff flag are added here. Change updateAlphaBeta instead.
+            playerChip = yellowChip if maximizingPlayer else redChip
+            bestScoreYet = -infinity if maximizingPlayer else infinity
             bestMoveYet = openColumnList[0]
             for col in openColumnList:
                 tempBoard = copy.deepcopy(board)
-                tempBoard.dropChip(col, redChip)
-                tempScore = self.miniMax_AlphaBeta(tempBoard, depth-1, alpha, beta, True)[1]
-                if tempScore < worstScoreYet:
-                    worstScoreYet = tempScore
-                    bestMoveYet = col
-                if worstScoreYet < beta:
-                    beta = worstScoreYet
-                
-                if alpha >= beta: 
+                tempBoard.dropChip(col, playerChip)
+                childPath = path + (col,) if self.tracer.bTraceChild(path) else None
+                tempScore = self.miniMax_AlphaBeta(tempBoard, depth-1, alpha, beta, not maximizingPlayer, childPath)[1]
+                bestScoreYet, bestMoveYet, alpha, beta = self.updateAlphaBeta(maximizingPlayer, col, tempScore, bestScoreYet, bestMoveYet, alpha, beta)
+                if alpha >= beta:
+                    bCutoff = True
                     break
-            return bestMoveYet, worstScoreYet
-            
+
+        self.tracer.recordNode(path, entryAlpha, entryBeta, bestScoreYet, bCutoff, perf_counter()-start)
+        return bestMoveYet, bestScoreYet
+
+    def endgameScore(self, board):
+        """
+        Returns the exact score of board, or None if it has too many empty cells
+        to be solved and is not in the endgame database either.
+        """
+        emptyCells = rows*columns - board.totalBoardChips
+        if emptyCells <= endgameEmptyCells:
+            result = self.endgameSolved.get(board.canonicalKey())
+            if result is None:
+                result = endgame.solve(endgame.positionFromBoard(board.board), self.endgameSolved)
+        elif self.endgame and emptyCells <= self.endgame.emptyCells:
+            result = self.endgame.probe(board.canonicalKey())
+            if result is None:
+                return None
+        else:
+            return None
+
+        if result == 0:
+            return 0
+        endPly = board.totalBoardChips + endgame.resultRange - abs(result)
+        if result > 0:
+            return endgameWinScore - endPly
+        return -(endgameWinScore - endPly)
+
+    def endgameMove(self, board):
+        """Returns the best column from the exact endgame scores, or None if one of them is not known."""
+        bestMoveYet = None
+        bestScoreYet = -infinity
+        for col in board.allOpenColumns():
+            tempBoard = copy.deepcopy(board)
+            tempBoard.dropChip(col, yellowChip)
+            if tempBoard.checkBoard() == yellowChip:
+                return col
+            tempScore = self.endgameScore(tempBoard)
+            if tempScore is None:
+                return None
+            if tempScore > bestScoreYet:
+                bestScoreYet = tempScore
+                bestMoveYet = col
+        return bestMoveYet
+
     def bestMove(self, board, depth): 
         """Returns a relativly good (but not ENTIRELY optimal) column to place the chip."""
         # Description of parameters for minimax:
@@ -328,9 +470,18 @@ class BestmoveAlgorithm():
         #  worst case initial alpha variable,
         #  worst case initial beta variable,
         #  The player calling this function is maximising
+        rootPath = None
+        if self.tracer:
+            self.tracer.beginSearch(board, depth)
+            rootPath = ()
         start = time()
-        column, payoff = self.miniMax_AlphaBeta(board, depth, -infinity, infinity, True)
+        column = self.endgameMove(board)
+        if column is not None:
+            payoff = "solved exactly"
+        else:
+            column, payoff = self.miniMax_AlphaBeta(board, depth, -infinity, infinity, True, rootPath)
         stop = time()
+        if self.tracer: self.tracer.endSearch()
         if bDebug: print(f"Time of depth {depth}: {stop-start}")
         if bDebug: print("Computer chose column", column, "with a payoff of:", payoff)
         return column
@@ -340,6 +491,7 @@ class Game():
         self.computer = BestmoveAlgorithm()
         self.drawLines()
         self.currentPlayer=redChip
+        self.moves = [] #every column played so far, for the game record
 
     def drawLines(self):
         """Draws rows and columns for Connect-4 board"""
@@ -374,7 +526,13 @@ class Game():
     def makeMove(self, col):
         """Simulates an entie player move"""
         self.dropChipGraphic(col)
+        self.moves.append(col)
         self.nextPlayerTurn()
+
+    def recordGame(self):
+        """Adds the columns played this game to gameRecordFileName, e.g. 3323442"""
+        with open(gameRecordFileName, "a") as recordFile:
+            recordFile.write("".join(str(col) for col in self.moves) + "\n")
 def main():
     depthForTimeComplexityTesting = 7 # for timing
     listOfTimePermoves = [] # for timing
@@ -409,6 +567,7 @@ def main():
                 print(f"Move {i+1} time: {listOfTimePermoves[i]} ")
 
             print("Game is over!", winner, "has won!")
+            game.recordGame()
         if game.currentPlayer==computer.player and not bGameOver:
             #Implement minimax algorithm 
 
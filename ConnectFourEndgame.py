@@ -0,0 +1,469 @@
+"""
+ConnectFourEndgame.py
+
+Exact solving and an endgame database for the last few moves of a
+connect-4 game.
+
+Near the end of the game "ConnectFourAgainstComputer(graphical).py" still
+stops searching at 'depth' and falls back on the scoring heuristic, even
+though so few empty cells are left that the exact result could be known.
+The database keeps how many plies each result is away, so the search can
+prefer quicker wins and slower losses the same way it does for the wins it
+finds itself.
+
+This file does two things:
+
+-When imported, solve() works out the exact result of a position with only
+ a few empty cells with a minimax over the game tree below it and a
+ memoization cache. It does not search every move: a position where the
+ player to move can win with one chip is settled straight away, and the
+ rest of a position's moves are skipped once one of them wins on the
+ player's next chip, as nothing can beat that. With 12 empty cells this only
+ takes a few milliseconds, far less than the normal search, so the game
+ solves such positions on the spot and keeps the results for the rest of
+ the game.
+
+-When run as a program it generates the database, a file of positions that
+ are already solved. It solves every seed position with at most '--empty'
+ empty cells and writes the exact result of every position solve() worked
+ out on the way, which is the seed and the part of the tree below it that
+ solve() had to search, not the whole tree.
+
+The game solves positions with up to 12 empty cells (endgameEmptyCells) on
+the spot, so the database is only worth having for positions with more empty
+cells than that, which take too long to solve during a move. By default it
+is seeded 16 empty cells from the end.
+
+There are far too many positions with 13-16 empty cells to list every one of
+them, and a game only benefits from the positions it actually reaches. So
+the seeds come from games that were really played: the game adds every
+finished game to gameRecords.txt, and '--records' seeds from each of them,
+plus every way the game could have gone in its last '--branch' moves before
+the seed. A later game that follows (or comes close to) one of those games
+then finds its positions in the database. Seeds where the player to move can
+win straight away are skipped, as they would only add a single position.
+
+'--games' adds seeds from plausible games (sensible but slightly random
+moves for both players) and '--check' reports how many positions along the
+seed games and along new plausible games are found in the database. Games
+that never come close to the seed games get next to no hits, so seeds from
+--games mostly help games played the same plausible way.
+
+RESULTS:
+
+Every result is stored from the computer's (yellow's) point of view as a
+single signed byte:
+
+     0       the game is a draw
+    +100-d   yellow wins d plies (single chip drops) from this position
+    -100+d   red wins d plies from this position
+
+so shorter wins and longer losses score better for the player winning or
+losing them.
+
+FILE FORMAT (all little endian):
+
+    header    4 byte magic "C4EG", version (1 byte), empty cells (1 byte),
+              number of positions (4 bytes)
+    keys      one 8 byte unsigned canonical key per position, sorted
+              (see ConnectFourGeometry.py, a position and its mirror image
+              share a key and a result so they are only stored once)
+    results   one signed byte per position, in the same order as the keys
+
+USAGE:
+
+    python ConnectFourEndgame.py --records gameRecords.txt --check 100
+    python ConnectFourEndgame.py --moves 33322244443321100 --empty 14 --branch 3
+    python ConnectFourEndgame.py --games 300 --out endgame.c4eg
+"""
+import argparse
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from time import time
+
+import ConnectFourGeometry as geometry
+
+magic = b"C4EG"
+version = 2
+headerFormat = "<4sBBI"
+resultRange = 100 #results are +/-(resultRange - plies to the end of the game)
+
+
+class EndgameTable():
+    """The loaded database, a sorted array of keys and a matching array of results."""
+    def __init__(self, emptyCells, keys, results):
+        self.emptyCells = emptyCells
+        self.keys = keys
+        self.results = results
+
+    def __len__(self):
+        return len(self.keys)
+
+    def probe(self, key):
+        """Returns the stored result for key, or None if the position is not in the table."""
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.results[i]
+        return None
+
+
+def loadTable(fileName):
+    """Returns the EndgameTable stored in fileName, or None if there is no such file."""
+    try:
+        with open(fileName, "rb") as tableFile:
+            data = tableFile.read()
+    except FileNotFoundError:
+        return None
+    start = struct.calcsize(headerFormat)
+    if len(data) < start:
+        raise ValueError(f"{fileName} is not a version {version} endgame database")
+    fileMagic, fileVersion, emptyCells, count = struct.unpack_from(headerFormat, data)
+    if fileMagic != magic or fileVersion != version:
+        raise ValueError(f"{fileName} is not a version {version} endgame database")
+    if len(data) != start + 9*count:
+        raise ValueError(f"{fileName} should hold {count} positions but is the wrong size, it may be cut short")
+    keys = array("Q", data[start:start + 8*count])
+    results = array("b", data[start + 8*count:start + 9*count])
+    if sys.byteorder == "big":
+        keys.byteswap()
+    return EndgameTable(emptyCells, keys, results)
+
+
+def writeTable(fileName, emptyCells, solved):
+    """Writes a {key: result} dict to fileName in the format described above."""
+    keys = array("Q", sorted(solved))
+    results = array("b", (solved[key] for key in keys))
+    if sys.byteorder == "big":
+        keys.byteswap()
+    with open(fileName, "wb") as tableFile:
+        tableFile.write(struct.pack(headerFormat, magic, version, emptyCells, len(keys)))
+        tableFile.write(keys.tobytes())
+        tableFile.write(results.tobytes())
+
+
+class EndgamePosition():
+    """
+    A light weight board used by solve(). Chips are dropped and taken
+    back in place rather than copying the board for every move, and the
+    position key and mirror key are updated as they are.
+    """
+    def __init__(self):
+        self.board = [[0 for c in range(geometry.columns)] for r in range(geometry.rows)]
+        self.heights = [0 for c in range(geometry.columns)]
+        self.totalBoardChips = 0
+        self.key = geometry.emptyKey
+        self.mirrorKey = geometry.emptyKey
+
+    def canonicalKey(self):
+        return min(self.key, self.mirrorKey)
+
+    def playerToMove(self):
+        """Red (the human) always goes first so the chip count decides whose turn it is."""
+        return geometry.redChip if self.totalBoardChips % 2 == 0 else geometry.yellowChip
+
+    def openColumns(self):
+        return [col for col in range(geometry.columns) if self.heights[col] < geometry.rows]
+
+    def dropChip(self, col):
+        """Drops the next player's chip in col and returns True if it won the game."""
+        height = self.heights[col]
+        row = geometry.rows-1 - height
+        player = self.playerToMove()
+        self.board[row][col] = player
+        self.heights[col] += 1
+        self.totalBoardChips += 1
+        self.key += geometry.keySteps[player][col][height]
+        self.mirrorKey += geometry.keySteps[player][geometry.columns-1 - col][height]
+        board = self.board
+        for (r0, c0), (r1, c1), (r2, c2), (r3, c3) in geometry.cellWindows[row][col]:
+            if geometry.windowWinners[board[r0][c0] + 3*board[r1][c1] + 9*board[r2][c2] + 27*board[r3][c3]]:
+                return True
+        return False
+
+    def undoChip(self, col):
+        """Takes back the top chip of col."""
+        self.heights[col] -= 1
+        self.totalBoardChips -= 1
+        height = self.heights[col]
+        row = geometry.rows-1 - height
+        player = self.board[row][col]
+        self.board[row][col] = 0
+        self.key -= geometry.keySteps[player][col][height]
+        self.mirrorKey -= geometry.keySteps[player][geometry.columns-1 - col][height]
+
+
+def positionFromBoard(board):
+    """Returns an EndgamePosition set up like a board (a list of rows, as in Board.board)."""
+    position = EndgamePosition()
+    position.board = [list(row) for row in board]
+    position.heights = [sum(1 for row in board if row[col]) for col in range(geometry.columns)]
+    position.totalBoardChips = sum(position.heights)
+    position.key = geometry.positionKey(board)
+    position.mirrorKey = geometry.mirrorKey(position.key)
+    return position
+
+
+def solve(position, solved):
+    """
+    Returns the exact result of position (see RESULTS above), storing it and the
+    result of every position below it that had to be searched in solved.
+    Nobody may have won already.
+    """
+    key = position.canonicalKey()
+    result = solved.get(key)
+    if result is not None:
+        return result
+
+    openColumns = position.openColumns()
+    if not openColumns: #board is full, the game is a draw
+        solved[key] = 0
+        return 0
+
+    bYellow = position.playerToMove() == geometry.yellowChip
+    sign = 1 if bYellow else -1
+    for col in openColumns: #winning straight away beats anything else
+        bWin = position.dropChip(col)
+        position.undoChip(col)
+        if bWin:
+            solved[key] = sign*(resultRange-1)
+            return solved[key]
+
+    bestResult = None
+    for col in openColumns:
+        position.dropChip(col)
+        childResult = solve(position, solved)
+        position.undoChip(col)
+        if childResult > 0: #one more ply to the end of the game
+            childResult -= 1
+        elif childResult < 0:
+            childResult += 1
+        if bestResult is None or sign*childResult > sign*bestResult:
+            bestResult = childResult
+        if sign*bestResult == resultRange-3: #winning on our next chip is the best left
+            break
+
+    solved[key] = bestResult
+    return bestResult
+
+
+def winningColumns(position):
+    """Returns the columns where the player to move would win with their next chip."""
+    winning = []
+    for col in position.openColumns():
+        if position.dropChip(col):
+            winning.append(col)
+        position.undoChip(col)
+    return winning
+
+
+def scoreOfPosition(position, player):
+    """The same score Board.scoreOfBoardPosition gives, used to pick plausible moves."""
+    board = position.board
+    windowScores = geometry.windowScores[player]
+    score = board[3].count(player) * 7
+    for (r0, c0), (r1, c1), (r2, c2), (r3, c3) in geometry.windows:
+        score += windowScores[board[r0][c0] + 3*board[r1][c1] + 9*board[r2][c2] + 27*board[r3][c3]]
+    return score
+
+
+def plausibleMove(position, generator, noise):
+    """
+    Returns a column a sensible player might choose: a winning chip if there is
+    one, otherwise a move that does not hand the opponent a win, picked by the
+    game's own scoring or, with a chance of noise, at random.
+    """
+    winning = winningColumns(position)
+    if winning:
+        return winning[0]
+    player = position.playerToMove()
+    safeMoves = [] #(score, column)
+    for col in position.openColumns():
+        position.dropChip(col)
+        if not winningColumns(position):
+            safeMoves.append((scoreOfPosition(position, player), col))
+        position.undoChip(col)
+    if not safeMoves: #every move loses, so any will do
+        return generator.choice(position.openColumns())
+    if generator.random() < noise:
+        return generator.choice(safeMoves)[1]
+    return max(safeMoves)[1]
+
+
+def bUsefulSeed(position):
+    """A seed where the player to move can win straight away would only add a single position."""
+    return not winningColumns(position)
+
+
+def playSeed(moves, emptyCells):
+    """
+    Plays a list of columns and returns the position once no more than emptyCells
+    cells are left, or None if the game ends, a move is illegal or the player to
+    move could win straight away.
+    """
+    position = EndgamePosition()
+    for col in moves:
+        if geometry.rows*geometry.columns - position.totalBoardChips <= emptyCells:
+            break
+        if col not in position.openColumns() or position.dropChip(col):
+            return None
+    if geometry.rows*geometry.columns - position.totalBoardChips > emptyCells or not bUsefulSeed(position):
+        return None
+    return position
+
+
+def branchSeeds(moves, emptyCells, branch):
+    """
+    Follows a played game until emptyCells + branch cells are left and returns every
+    useful seed position reached from there with branch more chips, so games that
+    leave the recorded one in its last few moves before the seed are covered too.
+    """
+    start = playSeed(moves, emptyCells + branch)
+    if start is None:
+        return []
+    seeds = []
+    def branchFrom(position, movesLeft):
+        if not movesLeft:
+            if bUsefulSeed(position):
+                seeds.append(positionFromBoard(position.board))
+            return
+        for col in position.openColumns():
+            if not position.dropChip(col):
+                branchFrom(position, movesLeft-1)
+            position.undoChip(col)
+    branchFrom(start, branch)
+    return seeds
+
+
+def plausibleGame(generator, emptyCells, noise):
+    """
+    Plays plausible moves for both players until no more than emptyCells cells are
+    left and returns the position, or None if the game ends first or the player to
+    move could win straight away.
+    """
+    position = EndgamePosition()
+    while geometry.rows*geometry.columns - position.totalBoardChips > emptyCells:
+        if position.dropChip(plausibleMove(position, generator, noise)):
+            return None
+    return position if bUsefulSeed(position) else None
+
+
+def branchSeeds(moves, emptyCells, branch):
+    """
+    Follows a played game until emptyCells + branch cells are left and returns every
+    useful seed position reached from there with branch more chips, so games that
+    leave the recorded one in its last few moves before the seed are covered too.
+    """
+    start = playSeed(moves, emptyCells + branch)
+    if start is None:
+        return []
+    seeds = []
+    def branchFrom(position, movesLeft):
+        if not movesLeft:
+            if bUsefulSeed(position):
+                seeds.append(positionFromBoard(position.board))
+            return
+        for col in position.openColumns():
+            if not position.dropChip(col):
+                branchFrom(position, movesLeft-1)
+            position.undoChip(col)
+    branchFrom(start, branch)
+    return seeds
+
+
+def plausibleGame(generator, emptyCells, noise, onPosition=None):
+    """
+    Plays plausible moves for both players until no more than emptyCells cells are
+    left and returns the position, or None if the game ends first or the player to
+    move could win straight away. onPosition, if given, is called with every
+    position along the way.
+    """
+    position = EndgamePosition()
+    while geometry.rows*geometry.columns - position.totalBoardChips > emptyCells:
+        if onPosition: onPosition(position)
+        if position.dropChip(plausibleMove(position, generator, noise)):
+            return None
+    if onPosition: onPosition(position)
+    return position if bUsefulSeed(position) else None
+
+
+def checkTable(table, seedGames, generator, games, noise):
+    """
+    Prints how many of the positions within the table's reach are found in it,
+    along each seed game and along new plausible games the generator did not see.
+    """
+    def countHits(moves):
+        position = EndgamePosition()
+        hits = reached = 0
+        for col in moves + [None]:
+            if geometry.rows*geometry.columns - position.totalBoardChips <= table.emptyCells:
+                reached += 1
+                hits += table.probe(position.canonicalKey()) is not None
+            if col is None or col not in position.openColumns() or position.dropChip(col):
+                break
+        return hits, reached
+
+    newGames = []
+    for i in range(games):
+        moves = []
+        position = EndgamePosition()
+        while position.openColumns():
+            moves.append(plausibleMove(position, generator, noise))
+            if position.dropChip(moves[-1]):
+                break
+        newGames.append(moves)
+
+    for label, moveLists in (("seed games", seedGames), ("new plausible games", newGames)):
+        if not moveLists:
+            continue
+        results = [countHits(moves) for moves in moveLists]
+        print(f"Check over {len(moveLists)} {label}: {sum(h for h, r in results)} of {sum(r for h, r in results)} positions "
+              f"with {table.emptyCells} or fewer empty cells found, {sum(1 for h, r in results if h)} games had a hit")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates the connect-4 endgame database.")
+    parser.add_argument("--empty", type=int, default=16, help="empty cells left in the seed positions")
+    parser.add_argument("--games", type=int, default=0, help="number of plausible games to also take seed positions from")
+    parser.add_argument("--noise", type=float, default=0.1, help="chance of a random (but safe) move in those games")
+    parser.add_argument("--moves", nargs="*", default=[], help="extra seed games as strings of column numbers, e.g. 3332224")
+    parser.add_argument("--records", help="file of played games, one per line like --moves (the game writes gameRecords.txt)")
+    parser.add_argument("--branch", type=int, default=2, help="also seed every way the given games could have gone in their last moves before the seed")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the plausible games")
+    parser.add_argument("--out", default="endgame.c4eg", help="file to write the database to")
+    parser.add_argument("--check", type=int, default=0, help="afterwards report database hits along the seed games and this many new ones")
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    seedGames = list(args.moves)
+    if args.records:
+        with open(args.records) as recordFile:
+            seedGames += [line.strip() for line in recordFile if line.strip()]
+    if not seedGames and not args.games:
+        parser.error("give some games to seed from with --records, --moves or --games")
+    seedPositions = []
+    for moves in seedGames:
+        seedPositions += branchSeeds([int(c) for c in moves], args.empty, args.branch)
+    seedPositions += [plausibleGame(generator, args.empty, args.noise) for i in range(args.games)]
+
+    start = time()
+    solved = {}
+    seeds = set()
+    for position in seedPositions:
+        if position is not None and position.canonicalKey() not in seeds:
+            solve(position, solved)
+            seeds.add(position.canonicalKey())
+
+    writeTable(args.out, args.empty, solved)
+    print(f"Solved {len(solved)} positions from {len(seeds)} different seed positions in {time()-start:.1f}s")
+    print("Database written to", args.out)
+
+    if args.check:
+        checkTable(loadTable(args.out), [[int(c) for c in moves] for moves in seedGames],
+                   random.Random(args.seed + 1), args.check, args.noise)
+
+
+if __name__ == "__main__":
+    main()
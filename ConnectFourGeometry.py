@@ -0,0 +1,144 @@
+"""
+ConnectFourGeometry.py
+
+Lookup tables describing the connect-4 board, built once when the module
+is imported and shared by the board evaluation and the win detection in
+"ConnectFourAgainstComputer(graphical).py".
+
+A 'window' is any four cells in a line (horizontal, vertical or diagonal)
+that could make a 4-in-a-row. A 6x7 board has 69 of them.
+
+Instead of counting chips in a window every time it is looked at, the four
+chips in a window are turned into a single 'pattern' number:
+
+    pattern = cell0 + 3*cell1 + 9*cell2 + 27*cell3
+
+Because every cell is 0 (empty), 1 (red) or 2 (yellow) there are only
+3^4 = 81 patterns, so the score and the winner of every pattern can be
+worked out ahead of time and looked up by index.
+
+A position is also given a single number, its 'key', so it can be stored in
+caches and databases. Every column gets 7 bits starting at 7*column. Going up
+from the bottom there is a 1 for every yellow chip and a 0 for every red
+chip, then a single 1 above the top chip marks how full the column is.
+
+The board looks the same in a mirror (column 0 swapped with column 6 and so
+on), and a position and its mirror image have the same result. The smaller of
+the key and the key of the mirror image is the 'canonical key', which both
+positions share, so anything stored by canonical key only has to be stored
+once for the pair.
+"""
+
+rows = 6
+columns = 7
+redChip = 1 #human
+yellowChip = 2 #computer
+
+
+def buildWindows():
+    """Returns a tuple of every window, each one a tuple of four (row, column) cells."""
+    windowList = []
+    for row in range(rows): #horizontal
+        for col in range(columns-3):
+            windowList.append(tuple((row, col+i) for i in range(4)))
+    for col in range(columns): #vertical
+        for row in range(rows-3):
+            windowList.append(tuple((row+i, col) for i in range(4)))
+    for row in range(rows-3): #diagonal increasing
+        for col in range(columns-3):
+            windowList.append(tuple((row+i, col+i) for i in range(4)))
+    for row in range(rows-3): #diagonal decreasing
+        for col in range(columns-3):
+            windowList.append(tuple((row+3-i, col+i) for i in range(4)))
+    return tuple(windowList)
+
+
+def buildCellWindows(windowTuple):
+    """Returns cellWindows[row][column], the tuple of windows passing through that cell."""
+    cellLists = [[[] for c in range(columns)] for r in range(rows)]
+    for window in windowTuple:
+        for row, col in window:
+            cellLists[row][col].append(window)
+    return tuple(tuple(tuple(cell) for cell in row) for row in cellLists)
+
+
+def patternChips(pattern):
+    """Returns the four chips (0, 1 or 2) that make up a pattern number."""
+    return [pattern // 3**i % 3 for i in range(4)]
+
+
+def scoreWindow(player, window):#NOTE: referenced from https://github.com/KeithGalli/Connect4-Python
+    """
+    Scores a window based on how many yellow and
+    red chips are counted.
+    """
+    score = 0
+    opponent = redChip
+    if player == redChip:
+        opponent = yellowChip
+    if window.count(player) == 4:
+        score += 100
+    elif window.count(player) == 3:
+        score += 4
+    elif window.count(player) == 2:
+        score += 2
+
+    if window.count(opponent) == 3:
+        score -= 6
+
+    return score
+
+
+def buildWindowScores():
+    """Returns windowScores[player][pattern], with an empty entry for player 0."""
+    return ((),) + tuple(tuple(scoreWindow(player, patternChips(pattern)) for pattern in range(3**4))
+                         for player in (redChip, yellowChip))
+
+
+def buildWindowWinners():
+    """Returns windowWinners[pattern], the player owning all four cells or 0."""
+    winners = []
+    for pattern in range(3**4):
+        chips = patternChips(pattern)
+        winners.append(chips[0] if chips.count(chips[0]) == 4 else 0)
+    return tuple(winners)
+
+
+def buildKeySteps():
+    """Returns keySteps[player][column][height], what dropping a chip there adds to a key."""
+    # the column's top marker moves up one and a yellow chip leaves its 1 behind
+    return ((),) + tuple(tuple(tuple(1 << (7*col + height + (player == yellowChip)) for height in range(rows))
+                               for col in range(columns))
+                         for player in (redChip, yellowChip))
+
+
+def positionKey(board):
+    """Returns the key of a board (a list of rows, as in Board.board)."""
+    key = 0
+    for col in range(columns):
+        height = 0
+        for row in range(rows-1, -1, -1):
+            chip = board[row][col]
+            if not chip:
+                break
+            if chip == yellowChip:
+                key |= 1 << (7*col + height)
+            height += 1
+        key |= 1 << (7*col + height)
+    return key
+
+
+def mirrorKey(key):
+    """Returns the key of the mirror image of the position with the given key."""
+    mirrored = 0
+    for col in range(columns):
+        mirrored |= (key >> 7*col & 0x7F) << 7*(columns-1 - col)
+    return mirrored
+
+
+windows = buildWindows()
+cellWindows = buildCellWindows(windows)
+windowScores = buildWindowScores()
+windowWinners = buildWindowWinners()
+keySteps = buildKeySteps()
+emptyKey = positionKey([[0 for c in range(columns)] for r in range(rows)])
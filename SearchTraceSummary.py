@@ -0,0 +1,166 @@
+"""
+SearchTraceSummary.py
+
+A small tool for reading the search trace written by
+"ConnectFourAgainstComputer(graphical).py" when bTrace is set to True.
+
+For every traced computer move it prints:
+
+-the hottest subtrees, meaning the move paths where the alpha-beta search
+ spent the most time (including everything searched below them).
+
+-a flame-graph style view where every row is one ply deeper than the row
+ above it and every node is as wide as the share of time spent inside it.
+
+It can also write the trace in the 'folded stacks' format, so it can be
+opened with flamegraph.pl or https://www.speedscope.app for a proper
+graphical flame graph.
+
+USAGE:
+
+    python SearchTraceSummary.py searchTrace.jsonl
+    python SearchTraceSummary.py searchTrace.jsonl --search 3 --top 5
+    python SearchTraceSummary.py searchTrace.jsonl --folded searchTrace.folded
+
+Infinite scores are written to the trace as the strings "inf" and "-inf"
+(JSON has no infinity) and are turned back into numbers when it is read.
+
+NOTE: time spent in subtrees that were not traced (because of the depth cap
+or the sample rate) is counted as time spent in the closest traced parent.
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def readTrace(fileName):
+    """Returns a dict of {search number: (header record, {path: node record})}."""
+    searches = {}
+    with open(fileName) as traceFile:
+        for line in traceFile:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "path" not in record: #header written at the start of every computer move
+                searches[record["search"]] = (record, {})
+            else:
+                for name in ("alpha", "beta", "score"):
+                    if isinstance(record[name], str): #"inf" or "-inf"
+                        record[name] = float(record[name])
+                searches[record["search"]][1][tuple(record["path"])] = record
+    return searches
+
+
+def selfTimes(nodes):
+    """Returns the time spent in each node excluding the time of its traced children."""
+    childTime = defaultdict(float)
+    for path, node in nodes.items():
+        if path:
+            childTime[path[:-1]] += node["time"]
+    return {path: max(node["time"] - childTime[path], 0.0) for path, node in nodes.items()}
+
+
+def pathName(path):
+    """Returns a readable name for a move path, the root being 'root'."""
+    if not path:
+        return "root"
+    return "root > " + " > ".join(f"col {col}" for col in path)
+
+
+def printHotSubtrees(nodes, top):
+    """Prints the slowest subtrees below the root along with their alpha-beta results."""
+    rootTime = nodes[()]["time"] if () in nodes else max(node["time"] for node in nodes.values())
+    subtrees = sorted((path for path in nodes if path), key=lambda path: nodes[path]["time"], reverse=True)
+    descendants = defaultdict(int)
+    for path in nodes:
+        for i in range(1, len(path)):
+            descendants[path[:i]] += 1
+
+    print(f"  Hottest subtrees (of {len(nodes)} traced nodes):")
+    for path in subtrees[:top]:
+        node = nodes[path]
+        share = 100 * node["time"] / rootTime if rootTime else 0
+        cutoff = "cutoff" if node["cutoff"] else "no cutoff"
+        print(f"    {node['time']:.4f}s {share:5.1f}%  {pathName(path)}  "
+              f"[alpha {node['alpha']}, beta {node['beta']}] -> {node['score']}, "
+              f"{cutoff}, {descendants[path]} traced nodes below")
+
+
+def printFlameView(nodes, width):
+    """Prints an icicle (upside down flame graph) of the traced tree, one row per ply."""
+    children = defaultdict(list)
+    for path in nodes:
+        if path:
+            children[path[:-1]].append(path)
+    rootPaths = [()] if () in nodes else sorted(path for path in nodes if len(path) == 1)
+    totalTime = sum(nodes[path]["time"] for path in rootPaths)
+    if not totalTime:
+        return
+
+    rows = defaultdict(list) #depth: [(start column, cell width, label)]
+    def place(path, start, cellWidth):
+        rows[len(path)].append((start, cellWidth, f"{path[-1]}" if path else "root"))
+        childStart = start
+        for child in sorted(children[path]):
+            childWidth = cellWidth * nodes[child]["time"] / nodes[path]["time"] if nodes[path]["time"] else 0
+            place(child, childStart, childWidth)
+            childStart += childWidth
+
+    start = 0.0
+    for path in rootPaths:
+        cellWidth = width * nodes[path]["time"] / totalTime
+        place(path, start, cellWidth)
+        start += cellWidth
+
+    print("  Flame view (each row is one ply deeper, width is time):")
+    for depth in sorted(rows):
+        line = [" "] * width
+        for start, cellWidth, label in rows[depth]:
+            first, last = round(start), min(round(start + cellWidth), width)
+            if last - first < 3: #too narrow to show anything useful
+                continue
+            cell = ("[" + label).ljust(last - first - 1, "-")[:last - first - 1] + "]"
+            line[first:last] = cell[:last - first]
+        if "".join(line).strip():
+            print("    " + "".join(line).rstrip())
+
+
+def writeFolded(searches, fileName):
+    """Writes every traced search in the folded stacks format used by flame graph tools."""
+    with open(fileName, "w") as foldedFile:
+        for searchNumber, (header, nodes) in sorted(searches.items()):
+            for path, seconds in sorted(selfTimes(nodes).items()):
+                stack = ";".join([f"search {searchNumber}"] + [f"col {col}" for col in path])
+                microseconds = round(seconds * 1_000_000)
+                if microseconds:
+                    foldedFile.write(f"{stack} {microseconds}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarises a Connect Four search trace.")
+    parser.add_argument("traceFile", help="JSON lines file written when bTrace is True")
+    parser.add_argument("--search", type=int, help="only summarise this computer move")
+    parser.add_argument("--top", type=int, default=10, help="number of hot subtrees to print")
+    parser.add_argument("--width", type=int, default=100, help="width of the flame view in characters")
+    parser.add_argument("--folded", help="also write the trace as folded stacks to this file")
+    args = parser.parse_args()
+
+    searches = readTrace(args.traceFile)
+    for searchNumber, (header, nodes) in sorted(searches.items()):
+        if args.search is not None and searchNumber != args.search:
+            continue
+        print(f"Search {searchNumber}: depth {header['depth']}, {header['chips']} chips on the board")
+        if not nodes:
+            print("  No nodes were traced.")
+            continue
+        printHotSubtrees(nodes, args.top)
+        printFlameView(nodes, args.width)
+        print()
+
+    if args.folded:
+        writeFolded(searches, args.folded)
+        print("Folded stacks written to", args.folded)
+
+
+if __name__ == "__main__":
+    main()